@@ -4,9 +4,12 @@ import os
 import re
 import streamlit as st
 import pandas as pd
+import numpy as np
 import duckdb
 import plotly.express as px
-import math
+import plotly.graph_objects as go
+
+from prepare_data import TABLES, parquet_path
 
 st.set_page_config(page_title="재고·수요 운영 대시보드", layout="wide", initial_sidebar_state="expanded")
 
@@ -61,187 +64,503 @@ def add_ref_vline(fig, x, label, line_dash="dash", line_color="gray"):
     return fig
 
 
+SCATTER_MAX_POINTS = 3000
+SCATTER_DOWNSAMPLE_TO = 2000
+
+
+def lttb_indices(x, y, n_out):
+    """Largest-Triangle-Three-Buckets: x 오름차순 점들 중 시각적 형태를 유지하는 n_out개 인덱스."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    bucket = (n - 2) / (n_out - 2)
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start = int(i * bucket) + 1
+        end = int((i + 1) * bucket) + 1
+        nxt_end = min(int((i + 2) * bucket) + 1, n)
+        avg_x, avg_y = x[end:nxt_end].mean(), y[end:nxt_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        idx[i + 1] = a
+    return idx
+
+
+def downsample_scatter(points, shortage_days, over_days):
+    """SKU 수가 많으면 정책선 부근·위험·과다·무수요 점은 모두 유지하고, 나머지 안정 구간만 LTTB로 줄인다."""
+    if len(points) <= SCATTER_MAX_POINTS:
+        return points
+    doh = points["doh_used"]
+    keep = (doh < shortage_days + 5) | (doh > over_days - 5) | (points["demand_30d"] == 0)
+    rest = points[~keep].sort_values("demand_30d", kind="stable")
+    picked = lttb_indices(rest["demand_30d"].to_numpy(float), rest["doh_used"].to_numpy(float), SCATTER_DOWNSAMPLE_TO)
+    return pd.concat([points[keep], rest.iloc[picked]])
+
+
+def _df_fingerprint(df):
+    """st.cache_data용 DataFrame 해시: 컬럼명 + 행 단위 해시(hash_pandas_object) 바이트."""
+    return (tuple(df.columns), pd.util.hash_pandas_object(df, index=True).values.tobytes())
+
+
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: _df_fingerprint})
+def build_cause_scatter(points, demand_p75, demand_p25, shortage_days, over_days):
+    """수요 × DOH 매트릭스 Figure를 dict로 생성·캐시 (입력이 같으면 Plotly 생성/직렬화 생략)."""
+    points = downsample_scatter(points, shortage_days, over_days)
+    # px.scatter(SVG) 대신 WebGL(Scattergl) 트레이스를 상태별로 직접 생성 — SKU가 많아도 브라우저 렌더 비용이 일정
+    color_map = {"긴급": "#e11d48", "주의": "#f97316", "안정": "#22c55e"}
+    max_demand = float(points["demand_30d"].max()) if not points.empty else 0.0
+    size_ref = max_demand / (20 ** 2) if max_demand > 0 else 1.0  # px.scatter(size=..., size_max=20)과 같은 버블 크기
+    fig = go.Figure()
+    for state in points["상태"].unique():
+        g = points[points["상태"] == state]
+        fig.add_trace(go.Scattergl(
+            x=g["demand_30d"],
+            y=g["doh_used"],
+            mode="markers",
+            name=state,
+            legendgroup=state,
+            marker=dict(color=color_map.get(state), size=g["demand_30d"], sizemode="area", sizeref=size_ref),
+            customdata=g[["sku", "sku_name", "onhand_qty"]].to_numpy(),
+            hovertemplate=(
+                "SKU: %{customdata[0]}<br>품목명: %{customdata[1]}<br>현재고: %{customdata[2]:,}"
+                "<br>최근 30일 수요: %{x:,}<br>DOH: %{y}<extra>" + state + "</extra>"
+            ),
+        ))
+    fig.update_layout(title="수요 × 재고회전일수(DOH) 매트릭스", legend_title_text="상태")
+    fig.update_layout(xaxis_title="최근 30일 수요(개)", yaxis_title="재고회전일수(DOH)")
+    add_ref_hline(fig, shortage_days, f"품절 위험 기준({shortage_days}일)", line_color="crimson")
+    add_ref_hline(fig, over_days, f"재고 과다 검토 기준({over_days}일)", line_color="steelblue")
+    add_ref_vline(fig, demand_p75, "수요 상위 25%", line_color="gray")
+    # 왼쪽 카드 3개(수요·DOH 조건)의 위치를 매트릭스에서 직관적으로 보여주기 위해
+    # 해당 조건에 속하는 점들에 동그라미 테두리 오버레이를 추가
+    cond_high_short_chart = (points["demand_30d"] >= demand_p75) & (points["doh_used"] < shortage_days)
+    cond_low_long_chart = (points["demand_30d"] <= demand_p25) & (points["doh_used"] > over_days)
+    cond_zero_with_stock_chart = (points["demand_30d"] == 0) & (points["onhand_qty"] > 0)
+
+    hs_pts = points[cond_high_short_chart]
+    if not hs_pts.empty:
+        fig.add_trace(go.Scattergl(
+            x=hs_pts["demand_30d"],
+            y=hs_pts["doh_used"],
+            mode="markers",
+            marker=dict(
+                size=22,
+                symbol="circle-open",
+                line=dict(color="#b91c1c", width=2),
+            ),
+            showlegend=False,
+            hoverinfo="skip",
+        ))
+
+    ll_pts = points[cond_low_long_chart]
+    if not ll_pts.empty:
+        fig.add_trace(go.Scattergl(
+            x=ll_pts["demand_30d"],
+            y=ll_pts["doh_used"],
+            mode="markers",
+            marker=dict(
+                size=22,
+                symbol="circle-open",
+                line=dict(color="#1d4ed8", width=2),
+            ),
+            showlegend=False,
+            hoverinfo="skip",
+        ))
+
+    zs_pts = points[cond_zero_with_stock_chart]
+    if not zs_pts.empty:
+        fig.add_trace(go.Scattergl(
+            x=zs_pts["demand_30d"],
+            y=zs_pts["doh_used"],
+            mode="markers",
+            marker=dict(
+                size=22,
+                symbol="circle-open",
+                line=dict(color="#374151", width=2),
+            ),
+            showlegend=False,
+            hoverinfo="skip",
+        ))
+    fig = apply_plotly_theme(fig)
+    return fig.to_dict()
+
+
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: _df_fingerprint})
+def build_status_pie(status_counts):
+    """재고 상태 분포 도넛 Figure를 dict로 생성·캐시."""
+    color_map = {"긴급": "#ef5350", "주의": "#ff9800", "안정": "#4caf50"}
+    fig = px.pie(status_counts, names="상태", values="count", color="상태", color_discrete_map=color_map, hole=0.4)
+    fig.update_layout(showlegend=True, margin=dict(t=30, b=30, l=30, r=30))
+    fig.update_traces(
+        textfont_size=22,
+        insidetextfont=dict(size=22),
+        marker=dict(line=dict(color="rgba(255,255,255,0.95)", width=1.5)),
+        pull=[0.01, 0.02, 0],
+    )
+    return apply_plotly_theme(fig).to_dict()
+
+
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: _df_fingerprint})
+def build_category_bar(bar_df):
+    """카테고리별 품절 위험 SKU 수 막대 Figure를 dict로 생성·캐시."""
+    fig = px.bar(bar_df, x="category", y="risk_sku_cnt", color="category", labels={"category": "카테고리", "risk_sku_cnt": "품절 위험 SKU 수"}, color_discrete_sequence=["#6366f1", "#818cf8", "#a5b4fc", "#c7d2fe"])
+    fig.update_layout(margin=dict(t=30, b=30, l=30, r=30), showlegend=False)
+    fig.update_traces(marker_line_color="rgba(255,255,255,0.9)", marker_line_width=1)
+    return apply_plotly_theme(fig).to_dict()
+
+
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: _df_fingerprint})
+def build_stockout_timeline(tl):
+    """예상 소진일 타임라인 Figure를 dict로 생성·캐시."""
+    fig = px.scatter(
+        tl,
+        x="est_date_used",
+        y="sku",
+        color="상태",
+        color_discrete_map={"긴급": "#e11d48", "주의": "#f97316", "안정": "#22c55e"},
+        hover_data=["sku", "sku_name", "warehouse", "doh_used"],
+        labels={"est_date_used": "date"},
+    )
+    fig.update_layout(
+        xaxis_title="예상 소진일",
+        yaxis_title="SKU",
+        xaxis=dict(tickformat="%Y-%m-%d"),
+    )
+    return apply_plotly_theme(fig).to_dict()
+
+
 def fmt_qty(v):
     if v is None or (isinstance(v, float) and pd.isna(v)):
         return "—"
     return f"{int(v):,}"
 
 
-def fmt_days(v):
-    if v is None or (isinstance(v, float) and pd.isna(v)):
-        return "—"
-    return f"{float(v):.1f}"
+def fmt_days_col(s, suffix=""):
+    return s.map(("{:.1f}" + suffix).format).mask(s.isna(), "—")
 
 
-def fmt_date(v):
-    if v is None or (isinstance(v, float) and pd.isna(v)):
-        return "—"
-    return str(pd.to_datetime(v).date()) if hasattr(pd.to_datetime(v), "date") else str(v)
+def _file_key(path):
+    """파일 1개당 os.stat 한 번으로 (mtime_ns, size) — 같은 초 안의 재작성도 크기로 구분."""
+    try:
+        st_ = os.stat(path)
+    except FileNotFoundError:
+        return (0, 0)
+    return (st_.st_mtime_ns, st_.st_size)
 
 
 def _data_file_mtime():
-    """CSV 수정 시 캐시가 무효화되도록 파일 mtime을 캐시 키로 사용."""
-    t1 = os.path.getmtime("inventory_daily.csv") if os.path.exists("inventory_daily.csv") else 0
-    t2 = os.path.getmtime("demand_daily.csv") if os.path.exists("demand_daily.csv") else 0
-    return (t1, t2)
+    """앱이 읽는 입력 CSV(TABLES) 중 하나라도 바뀌면 캐시가 무효화되도록 파일 상태를 캐시 키로 사용."""
+    return tuple(_file_key(f"{name}.csv") for name in TABLES)
 
 
-@st.cache_data
-def load_data(_cache_key):
-    sku = pd.read_csv("sku_master.csv")
-    demand = pd.read_csv("demand_daily.csv", parse_dates=["date"])
-    inv = pd.read_csv("inventory_daily.csv", parse_dates=["date"])
-    try:
-        inv_txn = pd.read_csv("inventory_txn.csv", parse_dates=["date", "txn_datetime"])
-    except FileNotFoundError:
-        inv_txn = pd.DataFrame(columns=["txn_datetime", "date", "sku", "warehouse", "txn_type", "qty", "ref_id", "reason_code"])
-    return sku, demand, inv, inv_txn
+def _to_int32(s):
+    """정수 컬럼을 int32로 축소 (결측·범위 초과 시 원본 유지). int8/16까지 줄이면 산술 중 오버플로 위험이 있어 int32까지만."""
+    if not pd.api.types.is_integer_dtype(s) or s.empty:
+        return s
+    info = np.iinfo(np.int32)
+    return s.astype("int32") if info.min <= s.min() and s.max() <= info.max else s
+
+
+# 이동평균 예측: SKU별 최근 window_days 평균을 generate_series로 horizon_days 동안 펼침 (학습 구간과 겹치는 범위만 사용)
+FORECAST_SQL = """
+WITH filtered_skus AS (
+  SELECT sku
+  FROM sku_master
+  WHERE ($cat = 'ALL' OR category = $cat)
+    AND ($sku_pick = 'ALL' OR sku = $sku_pick)
+),
+avg_window AS (
+  SELECT sku, GREATEST(AVG(demand_qty), 0) AS avg_val
+  FROM demand_daily
+  WHERE date > $base_date::DATE - INTERVAL (LEAST($window_days, $lookback_days)) DAY
+    AND date <= $base_date::DATE
+    AND sku IN (SELECT sku FROM filtered_skus)
+  GROUP BY sku
+)
+SELECT $base_date::DATE + INTERVAL (g.i) DAY AS date, a.sku, CAST(a.avg_val AS FLOAT) AS forecast_qty
+FROM avg_window a, generate_series(1, $horizon_days) g(i)
+ORDER BY a.sku, g.i
+"""
+
+# 계절 단순 예측: SKU별 최근 season_days 일의 수요 패턴을 horizon_days 동안 반복 (빠진 날은 0)
+SEASONAL_FORECAST_SQL = """
+WITH filtered_skus AS (
+  SELECT sku
+  FROM sku_master
+  WHERE ($cat = 'ALL' OR category = $cat)
+    AND ($sku_pick = 'ALL' OR sku = $sku_pick)
+),
+season AS (
+  SELECT sku, DATE_DIFF('day', date, $base_date::DATE) AS lag, GREATEST(demand_qty, 0) AS qty
+  FROM demand_daily
+  WHERE date > $base_date::DATE - INTERVAL ($season_days) DAY
+    AND date <= $base_date::DATE
+    AND sku IN (SELECT sku FROM filtered_skus)
+),
+season_skus AS (
+  SELECT DISTINCT sku FROM season
+)
+SELECT $base_date::DATE + INTERVAL (g.i) DAY AS date, s.sku, CAST(COALESCE(p.qty, 0) AS FLOAT) AS forecast_qty
+FROM season_skus s
+CROSS JOIN generate_series(1, $horizon_days) g(i)
+LEFT JOIN season p ON p.sku = s.sku AND p.lag = $season_days - 1 - (g.i - 1) % $season_days
+ORDER BY s.sku, g.i
+"""
 
 
-def compute_forecast(demand_df, sku_df, cat, wh, sku_pick, base_date_str, horizon_days=60, lookback_days=180, window_days=14):
+@st.cache_data(show_spinner=False)
+def compute_forecast(cache_key, cat, sku_pick, base_date_str, horizon_days=60, lookback_days=180, window_days=14, season_days=0):
     """
-    간단한 수요 예측: Moving Average 기반.
+    간단한 수요 예측: Moving Average / Seasonal Naive (DuckDB에서 한 번의 쿼리로 계산).
     - 최근 lookback_days 구간에서 SKU별 일별 수요 사용
-    - 각 SKU별 최근 window_days 평균 수요를 horizon_days 기간 동안 고정 예측
-    - 창고 필터(wh)는 예측 대상 SKU만 제한하는 용도로만 사용 (수요는 전체 합계 기준)
+    - season_days == 0: 각 SKU별 최근 window_days 평균 수요를 horizon_days 기간 동안 고정 예측
+    - season_days > 0: 각 SKU별 최근 season_days 일의 수요를 horizon_days 기간 동안 반복
+    - 창고 필터는 받지 않음 (수요는 전체 합계 기준, 창고는 compute_forecast_metrics의 현재고 집계에서만 적용)
     """
-    if demand_df is None or demand_df.empty:
-        return pd.DataFrame(columns=["date", "sku", "forecast_qty"])
-    latest = pd.to_datetime(base_date_str)
-    df = demand_df.copy()
-    df["date"] = pd.to_datetime(df["date"])
-    # 필터: 기준일 이전 lookback_days 구간
-    start = latest - pd.Timedelta(days=lookback_days)
-    df = df[(df["date"] > start) & (df["date"] <= latest)]
-    # 카테고리·SKU 필터
-    sku_filtered = sku_df.copy()
-    if cat != "ALL":
-        sku_filtered = sku_filtered[sku_filtered["category"] == cat]
-    if sku_pick != "ALL":
-        sku_filtered = sku_filtered[sku_filtered["sku"] == sku_pick]
-    sku_list = sku_filtered["sku"].unique().tolist()
-    if not sku_list:
-        return pd.DataFrame(columns=["date", "sku", "forecast_qty"])
-    df = df[df["sku"].isin(sku_list)]
-    if df.empty:
-        return pd.DataFrame(columns=["date", "sku", "forecast_qty"])
-    rows = []
-    for sku_code, g in df.groupby("sku"):
-        g = g.sort_values("date")
-        hist_window = g[g["date"] > latest - pd.Timedelta(days=window_days)]
-        if hist_window.empty:
-            continue
-        avg_val = max(0.0, hist_window["demand_qty"].mean())
-        for i in range(1, horizon_days + 1):
-            fd = latest + pd.Timedelta(days=i)
-            rows.append({"date": fd, "sku": sku_code, "forecast_qty": avg_val})
-    return pd.DataFrame(rows) if rows else pd.DataFrame(columns=["date", "sku", "forecast_qty"])
-
-
-def compute_forecast_metrics(forecast_daily_df, latest_inv_df, horizon_days, base_date_str):
+    # forecast_qty는 FLOAT(float32)로 받음 — SKU×horizon 행으로 가장 큰 프레임이라 전송·캐시 바이트 절반 (합계는 DuckDB에서 DOUBLE로 누적)
+    params = {
+        "cat": cat,
+        "sku_pick": sku_pick,
+        "base_date": base_date_str,
+        "horizon_days": horizon_days,
+        "lookback_days": lookback_days,
+        "window_days": window_days,
+    }
+    if season_days > 0:
+        params = {k: params[k] for k in ("cat", "sku_pick", "base_date", "horizon_days")}
+        params["season_days"] = min(season_days, lookback_days)
+        return con.cursor().execute(SEASONAL_FORECAST_SQL, params).fetchdf()
+    return con.cursor().execute(FORECAST_SQL, params).fetchdf()
+
+
+# 예측 지표: SKU별 예측 합계·향후 7일 합계와, 누적 예측(윈도 합)이 현재고를 처음 넘는 날짜를 한 번의 스캔으로 계산
+# 현재고(inv_now)도 같은 쿼리에서 집계 — 기준일 재고가 하나도 없으면 빈 결과(실적 기반 폴백)
+FORECAST_METRICS_SQL = """
+WITH inv_now AS (
+  SELECT sku, SUM(onhand_qty) AS onhand_qty
+  FROM inventory_daily
+  WHERE date = $base_date::DATE AND ($wh = 'ALL' OR warehouse = $wh)
+  GROUP BY sku
+),
+cum AS (
+  SELECT
+    f.sku, f.date, f.forecast_qty,
+    COALESCE(i.onhand_qty, 0) AS onhand_qty,
+    SUM(f.forecast_qty) OVER (PARTITION BY f.sku ORDER BY f.date ROWS UNBOUNDED PRECEDING) AS cum_qty
+  FROM fdaily f
+  LEFT JOIN inv_now i ON f.sku = i.sku
+)
+SELECT
+  sku,
+  SUM(forecast_qty) AS forecast_total,
+  COALESCE(SUM(forecast_qty) FILTER (WHERE date <= $base_date::DATE + INTERVAL 7 DAY), 0) AS forecast_demand_next7,
+  CAST(ANY_VALUE(onhand_qty) AS DOUBLE) AS onhand_qty,
+  MIN(date) FILTER (WHERE cum_qty > onhand_qty) AS stockout_date_forecast
+FROM cum
+WHERE EXISTS (SELECT 1 FROM inv_now)
+GROUP BY sku
+ORDER BY sku
+"""
+
+
+# 입력 프레임은 해시하지 않고(_ 접두) 예측 인자 튜플 cache_key로 구분 — 프레임 내용 해시 비용 없음
+@st.cache_data(show_spinner=False)
+def compute_forecast_metrics(cache_key, _forecast_daily_df, horizon_days, base_date_str, wh):
     """
-    forecast_daily(date, sku, forecast_qty)와 latest_inv(sku, onhand_qty)로
+    forecast_daily(date, sku, forecast_qty)와 기준일 현재고(inventory_daily)로
     forecast_avg_daily, forecast_dos, stockout_date_forecast, forecast_demand_next7 계산.
     """
-    if forecast_daily_df is None or forecast_daily_df.empty:
+    if _forecast_daily_df is None or _forecast_daily_df.empty:
         return pd.DataFrame()
-    latest = pd.to_datetime(base_date_str)
-    f = forecast_daily_df.copy()
-    f["date"] = pd.to_datetime(f["date"])
-    inv = latest_inv_df.copy()
-    if inv.empty:
+    # 예측 프레임은 이 cursor에만 등록 (세션 간 공유 연결에 이름이 남지 않음)
+    cur = con.cursor()
+    cur.register("fdaily", _forecast_daily_df)
+    agg = cur.execute(FORECAST_METRICS_SQL, {"base_date": base_date_str, "wh": wh}).fetchdf()
+    if agg.empty:
         return pd.DataFrame()
-    if "warehouse" in inv.columns:
-        inv = inv.groupby("sku")["onhand_qty"].sum().reset_index()
-    agg = f.groupby("sku").agg(forecast_total=("forecast_qty", "sum")).reset_index()
     agg["forecast_avg_daily"] = (agg["forecast_total"] / float(horizon_days)).round(2)
-    f7 = f[f["date"] <= latest + pd.Timedelta(days=7)]
-    next7 = f7.groupby("sku")["forecast_qty"].sum().reset_index().rename(columns={"forecast_qty": "forecast_demand_next7"})
-    agg = agg.merge(next7, on="sku", how="left").fillna({"forecast_demand_next7": 0})
-    agg = agg.merge(inv, on="sku", how="left")
-    agg["onhand_qty"] = agg["onhand_qty"].fillna(0)
-    def _dos(row):
-        if row["forecast_avg_daily"] and row["forecast_avg_daily"] > 0:
-            return round(row["onhand_qty"] / row["forecast_avg_daily"], 1)
-        return None
-    agg["forecast_dos"] = agg.apply(_dos, axis=1)
-    stockout_rows = []
-    for sku_code, g in f.groupby("sku"):
-        g = g.sort_values("date").copy()
-        onhand = float(agg.loc[agg["sku"] == sku_code, "onhand_qty"].iloc[0]) if (agg["sku"] == sku_code).any() else 0.0
-        g["cum"] = g["forecast_qty"].cumsum()
-        over = g[g["cum"] > onhand]
-        d = over["date"].iloc[0] if not over.empty else pd.NaT
-        stockout_rows.append({"sku": sku_code, "stockout_date_forecast": d})
-    stockout_df = pd.DataFrame(stockout_rows)
-    agg = agg.merge(stockout_df, on="sku", how="left")
+    # 예측 일평균이 0 이하(또는 없음)인 SKU는 DOS 없음(NaN), 반올림은 coverage_days와 같은 half-up(round_dos)
+    avg = agg["forecast_avg_daily"]
+    agg["forecast_dos"] = round_dos(agg["onhand_qty"] / avg.where(avg > 0))
     return agg
 
 
-def compute_mape_backtest(demand_df, base_date_str, backtest_days=14, window_days=14):
+# 백테스트: t일 예측 = 같은 SKU의 [t-window_days, t) 구간 평균 (RANGE 윈도, 같은 날짜 행은 EXCLUDE GROUP으로 제외)
+MAPE_BACKTEST_SQL = """
+WITH hist AS (
+  SELECT sku, date, demand_qty,
+    AVG(demand_qty) OVER (
+      PARTITION BY sku ORDER BY date
+      RANGE BETWEEN INTERVAL ($window_days) DAY PRECEDING AND CURRENT ROW EXCLUDE GROUP
+    ) AS pred
+  FROM demand_daily
+  WHERE date >= $base_date::DATE - INTERVAL ($backtest_days + $window_days) DAY
+    AND date <= $base_date::DATE
+),
+per_day AS (
+  SELECT sku, date, SUM(demand_qty) AS actual, ANY_VALUE(pred) AS pred
+  FROM hist
+  WHERE date > $base_date::DATE - INTERVAL ($backtest_days) DAY
+  GROUP BY sku, date
+)
+SELECT CAST(AVG(ABS(actual - GREATEST(pred, 0)) / actual) * 100 AS DOUBLE) AS mape_pct, COUNT(*) AS n
+FROM per_day
+WHERE actual > 0 AND pred IS NOT NULL
+"""
+
+
+@st.cache_data(show_spinner=False)
+def compute_mape_backtest(cache_key, base_date_str, backtest_days=14, window_days=14):
     """
     Naive backtest: 마지막 backtest_days 동안, t일의 예측을 그 이전 window_days 평균으로 추정.
-    Mean Absolute Percentage Error (평균 절대 백분율 오차, MAPE)를 반환.
+    Mean Absolute Percentage Error (평균 절대 백분율 오차, MAPE)를 반환 (DuckDB 윈도 쿼리 한 번으로 계산).
     """
-    if demand_df is None or demand_df.empty:
-        return None, 0
-    latest = pd.to_datetime(base_date_str)
-    df = demand_df.copy()
-    df["date"] = pd.to_datetime(df["date"])
-    start = latest - pd.Timedelta(days=backtest_days)
-    actuals = df[(df["date"] > start) & (df["date"] <= latest)]
-    if actuals.empty:
+    params = {"base_date": base_date_str, "backtest_days": backtest_days, "window_days": window_days}
+    mape_pct, n = con.cursor().execute(MAPE_BACKTEST_SQL, params).fetchone()
+    if not n:
         return None, 0
-    errors = []
-    for (sku_code, dt), g in actuals.groupby(["sku", "date"]):
-        actual = g["demand_qty"].sum()
-        if actual <= 0:
-            continue
-        hist = df[(df["sku"] == sku_code) & (df["date"] < dt) & (df["date"] >= dt - pd.Timedelta(days=window_days))]
-        if hist.empty:
-            continue
-        pred = max(0.0, hist["demand_qty"].mean())
-        ape = abs(actual - pred) / actual if actual else 0
-        errors.append(ape)
-    if not errors:
-        return None, 0
-    mape_pct = sum(errors) / len(errors) * 100.0
-    return mape_pct, len(errors)
+    return mape_pct, n
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def get_con(cache_key):
+    """DuckDB 인메모리 연결을 데이터 버전당 한 번만 만들어 rerun·세션 간 공유 (Parquet 파일 위 뷰 — pandas 적재 없이 DuckDB가 직접 스캔)."""
+    # 스레드 수는 이 프로세스가 실제로 쓸 수 있는 CPU 수에 맞춤 (컨테이너 affinity 제한 반영)
+    n_cpu = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 4)
+    conn = duckdb.connect(database=":memory:", config={"threads": n_cpu})
+    # 모든 쿼리가 Parquet 뷰를 스캔하므로 파일 메타데이터(스키마·row group 통계)는 연결 단위로 캐시해 쿼리마다 다시 읽지 않음
+    # (parquet 확장은 연결 생성 후에 로드되므로 config가 아니라 SET으로 지정)
+    conn.execute("SET parquet_metadata_cache = true")
+    # CSV → Parquet 변환은 prepare_data.parquet_path 하나로 (devcontainer 사전 변환과 같은 규칙)
+    for name in TABLES:
+        path = parquet_path(name)
+        if path:
+            conn.execute(f"CREATE VIEW {name} AS SELECT * FROM read_parquet('{path}')")
+        else:
+            # Parquet를 쓸 수 없는 환경이면 CSV를 한 번만 파싱해 테이블로 적재 (쿼리마다 재파싱 방지)
+            conn.execute(f"CREATE TABLE {name} AS SELECT * FROM read_csv_auto('{name}.csv')")
+    return conn
 
 
-sku, demand, inv, inv_txn = load_data(_data_file_mtime())
-con = duckdb.connect(database=":memory:")
-con.register("sku_master", sku)
-con.register("demand_daily", demand)
-con.register("inventory_daily", inv)
+data_key = _data_file_mtime()
+con = get_con(data_key)
 
 
-def get_base_sku_where(cat, wh, sku_pick):
-    parts = []
-    if cat != "ALL":
-        parts.append(f"AND m.category = '{cat}'")
-    if sku_pick != "ALL":
-        parts.append(f"AND m.sku = '{sku_pick}'")
-    if wh != "ALL":
-        parts.append(f"AND EXISTS (SELECT 1 FROM inventory_daily i WHERE i.sku = m.sku AND i.warehouse = '{wh}')")
-    return "\n    ".join(parts) if parts else ""
+# --- SQL: 필터 값은 바인딩 파라미터로 전달 (쿼리 텍스트 고정 → DuckDB 파싱/플랜 재사용) ---
+# 'ALL'이면 해당 조건을 건너뛰도록 ($x = 'ALL' OR ...) 형태로 작성
+DETAIL_SQL = """
+WITH base_sku AS (
+  SELECT m.sku, m.sku_name, m.category
+  FROM sku_master m
+  WHERE ($cat = 'ALL' OR m.category = $cat)
+    AND ($sku_pick = 'ALL' OR m.sku = $sku_pick)
+    AND ($wh = 'ALL' OR EXISTS (SELECT 1 FROM inventory_daily i WHERE i.sku = m.sku AND i.warehouse = $wh))
+),
+latest_inv AS (
+  SELECT sku, warehouse, onhand_qty
+  FROM inventory_daily
+  WHERE date = $base_date::DATE AND ($wh = 'ALL' OR warehouse = $wh)
+),
+demand_win AS (
+  SELECT
+    sku,
+    SUM(demand_qty) FILTER (WHERE date > $base_date::DATE - INTERVAL 30 DAY) AS demand_30d,
+    SUM(demand_qty) FILTER (WHERE date > $base_date::DATE - INTERVAL ($dos_basis_days) DAY) AS demand_14,
+    SUM(demand_qty) FILTER (WHERE date > $base_date::DATE - INTERVAL 7 DAY) AS demand_7d
+  FROM demand_daily
+  WHERE date > $base_date::DATE - INTERVAL (GREATEST($dos_basis_days, 30)) DAY AND date <= $base_date::DATE
+  GROUP BY sku
+)
+SELECT
+  b.sku, b.sku_name, b.category, li.warehouse,
+  COALESCE(li.onhand_qty, 0) AS onhand_qty,
+  CAST(COALESCE(d.demand_30d, 0) AS DOUBLE) AS demand_30d,
+  CAST(COALESCE(d.demand_14, 0) AS DOUBLE) AS demand_14,
+  CAST(COALESCE(d.demand_7d, 0) AS DOUBLE) AS demand_7d
+FROM base_sku b
+LEFT JOIN latest_inv li ON b.sku = li.sku
+LEFT JOIN demand_win d ON b.sku = d.sku
+ORDER BY b.sku, li.warehouse
+"""
 
 
-def _inv_wh_where(wh):
-    return f"AND warehouse = '{wh}'" if wh != "ALL" else ""
+# --- 쿼리 결과 캐시: 캐시 키 = 데이터 mtime + 필터/정책 원값 (탭 전환 등 무관한 rerun은 DuckDB 미호출) ---
+@st.cache_data(show_spinner=False)
+def fetch_detail(cache_key, cat, wh, sku_pick, base_date, dos_basis_days):
+    params = {
+        "cat": cat,
+        "wh": wh,
+        "sku_pick": sku_pick,
+        "base_date": base_date,
+        "dos_basis_days": dos_basis_days,
+    }
+    tbl = con.cursor().execute(DETAIL_SQL, params).to_arrow_table()
+    # coverage_days / 예상 품절일은 Arrow 컬럼을 numpy로 바로 받아 계산 (SQL CASE 2개 제거, 전송 컬럼 축소)
+    onhand = tbl.column("onhand_qty").to_numpy().astype(float)
+    demand_14 = tbl.column("demand_14").to_numpy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        raw_dos = np.where(demand_14 > 0, onhand * dos_basis_days / demand_14, np.nan)
+    detail = tbl.to_pandas()
+    # 반복값이 적은 코드 컬럼은 category, 현재고는 int32로 축소 (이후 groupby·마스크·캐시 해시 비용 절감)
+    for c in ("sku", "category", "warehouse"):
+        detail[c] = detail[c].astype("category")
+    detail["onhand_qty"] = _to_int32(detail["onhand_qty"])
+    detail["coverage_days"] = round_dos(raw_dos)
+    detail["estimated_stockout_date"] = pd.Timestamp(base_date) + pd.to_timedelta(np.ceil(raw_dos), unit="D")
+    return detail
+
+
+def round_dos(x):
+    """DuckDB ROUND(x, 1)과 같은 half-up 반올림 (np.round는 짝수 반올림이라 결과가 달라질 수 있음)."""
+    return np.floor(x * 10 + 0.5) / 10
+
+
+def summarize_kpi(detail_df, dos_basis_days, shortage_days):
+    """상세(SKU×창고) 결과에서 KPI 산출 — 창고별 행을 SKU 단위로 합산한 뒤 계산하므로 별도 KPI 쿼리가 필요 없음."""
+    per_sku = detail_df.groupby("sku", sort=False, observed=True).agg(
+        onhand_qty=("onhand_qty", "sum"),
+        demand_14=("demand_14", "first"),
+        demand_7d=("demand_7d", "first"),
+    )
+    coverage = round_dos(per_sku["onhand_qty"] * dos_basis_days / per_sku["demand_14"].where(per_sku["demand_14"] > 0))
+    return {
+        "total_onhand": per_sku["onhand_qty"].sum(),
+        "demand_cur_7": per_sku["demand_7d"].sum(),
+        "median_dos": coverage.median(),
+        "stockout_sku_cnt": int((coverage < shortage_days).sum()),
+    }
 
 
 # --- 사이드바: 조회 조건만 (정책/예측은 관리자 탭에서) ---
+@st.cache_data(show_spinner=False)
+def sidebar_options(cache_key):
+    """사이드바 선택지(기준일·카테고리·창고·SKU) — 데이터 파일이 바뀌기 전까지 rerun마다 다시 만들지 않음."""
+    # 선택지는 작은 결과라 DataFrame 없이 튜플로 바로 받음
+    cur = con.cursor()
+
+    def distinct(col, table, order="ASC"):
+        return [row[0] for row in cur.execute(f"SELECT DISTINCT {col} AS v FROM {table} WHERE v IS NOT NULL ORDER BY v {order}").fetchall()]
+
+    return {
+        "date": distinct("strftime(date, '%Y-%m-%d')", "inventory_daily", "DESC"),
+        "cat": ["ALL"] + distinct("category", "sku_master"),
+        "wh": ["ALL"] + distinct("warehouse", "inventory_daily"),
+        "sku": ["ALL"] + distinct("sku", "sku_master"),
+    }
+
+
 st.sidebar.header("조회 조건")
-all_dates = con.execute("SELECT DISTINCT date FROM inventory_daily ORDER BY date DESC").fetchdf()
-date_opts = all_dates["date"].astype(str).tolist() if not all_dates.empty else []
+options = sidebar_options(data_key)
+date_opts = options["date"]
 default_date = date_opts[0] if date_opts else None
 if not date_opts:
     st.sidebar.caption("기준일 선택을 위해 재고 일별 데이터가 필요합니다.")
 
-cat_opts = ["ALL"] + sorted(sku["category"].unique().tolist())
-wh_opts = ["ALL"] + sorted(inv["warehouse"].unique().tolist())
-sku_opts = ["ALL"] + sorted(sku["sku"].unique().tolist())
+cat_opts = options["cat"]
+wh_opts = options["wh"]
+sku_opts = options["sku"]
 category_map = {"ALL": "전체", "Motor": "모터", "Brake": "브레이크", "Steering": "스티어링", "Sensor": "센서"}
 warehouse_map = {"ALL": "전체", "WH-1": "창고 1", "WH-2": "창고 2"}
 
@@ -281,7 +600,6 @@ if base_date is None:
     st.warning("재고 일별 데이터가 없습니다. inventory_daily.csv를 확인하세요.")
     st.stop()
 
-base_where = get_base_sku_where(cat, wh, sku_pick)
 base_date_ts = pd.to_datetime(base_date)
 
 # --- 정책·예측 설정: 관리자 탭에서 설정한 값 사용 (session_state, 없으면 기본값) ---
@@ -296,138 +614,54 @@ SHORTAGE_DAYS = shortage_days
 OVER_DAYS = over_days
 LEAD_TIME_DAYS = lead_time_days
 DOS_BASIS_DAYS = dos_basis_days
+# 상태 판정 기준 시각은 rerun당 한 번만 계산해 재사용
+LEAD_CUT_TS = base_date_ts + pd.Timedelta(days=LEAD_TIME_DAYS)
+SHORTAGE_CUT_TS = base_date_ts + pd.Timedelta(days=SHORTAGE_DAYS)
+
+# 예측 모델 선택지와 인덱스 조회용 dict (관리 탭 selectbox에서 사용)
+MODEL_OPTS = ["MovingAvg(7)", "MovingAvg(14)", "MovingAvg(30)", "SeasonalNaive(7)"]
+MODEL_IDX = {m: i for i, m in enumerate(MODEL_OPTS)}
 
 MODEL_NAME = st.session_state.get("admin_forecast_model", "MovingAvg(14)")
 FORECAST_HORIZON_DAYS = int(st.session_state.get("admin_forecast_horizon", 60))
 FORECAST_LOOKBACK_DAYS = int(st.session_state.get("admin_forecast_lookback", 180))
-# MovingAvg(N)에서 N 추출, 없으면 14
-if "MovingAvg" in MODEL_NAME:
-    m = re.search(r"\((\d+)\)", MODEL_NAME)
-    forecast_window_days = int(m.group(1)) if m else 14
-else:
+# MovingAvg(N) / SeasonalNaive(N)에서 N 추출, 없으면 14 (SeasonalNaive는 7)
+m = re.search(r"\((\d+)\)", MODEL_NAME)
+if "SeasonalNaive" in MODEL_NAME:
     forecast_window_days = 14
+    forecast_season_days = int(m.group(1)) if m else 7
+else:
+    forecast_window_days = int(m.group(1)) if m else 14
+    forecast_season_days = 0
 
 # --- 예측 계산 (옵션 B: 내부 예측 유지, 실패 시 자동 폴백 A) ---
-forecast_daily = compute_forecast(
-    demand_df=demand,
-    sku_df=sku,
-    cat=cat,
-    wh=wh,
-    sku_pick=sku_pick,
-    base_date_str=base_date,
-    horizon_days=FORECAST_HORIZON_DAYS,
-    lookback_days=FORECAST_LOOKBACK_DAYS,
-    window_days=forecast_window_days,
-)
-latest_inv_df = con.execute(
-    f"""
-    SELECT sku, SUM(onhand_qty) AS onhand_qty
-    FROM inventory_daily
-    WHERE date = '{base_date}' {_inv_wh_where(wh)}
-    GROUP BY sku
-    """
-).fetchdf()
-forecast_metrics_df = compute_forecast_metrics(forecast_daily, latest_inv_df, FORECAST_HORIZON_DAYS, base_date) if not latest_inv_df.empty else pd.DataFrame()
+forecast_args = {
+    "cat": cat,
+    "sku_pick": sku_pick,
+    "base_date_str": base_date,
+    "horizon_days": FORECAST_HORIZON_DAYS,
+    "lookback_days": FORECAST_LOOKBACK_DAYS,
+    "window_days": forecast_window_days,
+    "season_days": forecast_season_days,
+}
+forecast_daily = compute_forecast(data_key, **forecast_args)
+# 예측 프레임은 (데이터 버전 + 위 스칼라 인자)로 결정되므로 프레임 대신 그 튜플을 캐시 키로 사용 (창고는 wh 인자로 별도 구분)
+forecast_key = (data_key, *forecast_args.values())
+forecast_metrics_df = compute_forecast_metrics(forecast_key, forecast_daily, FORECAST_HORIZON_DAYS, base_date, wh)
 use_forecast = not forecast_metrics_df.empty
-mape_pct, mape_n = compute_mape_backtest(demand, base_date) if use_forecast else (None, 0)
+mape_pct, mape_n = compute_mape_backtest(data_key, base_date) if use_forecast else (None, 0)
 if not use_forecast:
     forecast_daily = pd.DataFrame()
     forecast_metrics_df = pd.DataFrame()
 
 # --- 공통 KPI/원인/시점/조치용 데이터 (실적 기반 DOH) ---
-kpi_sql = f"""
-WITH base_sku AS (SELECT m.sku, m.category FROM sku_master m WHERE 1=1 {base_where}),
-latest_inv AS (
-  SELECT sku, SUM(onhand_qty) AS onhand_qty
-  FROM inventory_daily
-  WHERE date = '{base_date}' {_inv_wh_where(wh)}
-  GROUP BY sku
-),
-demand_14 AS (
-  SELECT sku, SUM(demand_qty) AS demand_14
-  FROM demand_daily
-  WHERE date > '{base_date}'::DATE - INTERVAL {DOS_BASIS_DAYS} DAY AND date <= '{base_date}'
-  GROUP BY sku
-),
-demand_7 AS (
-  SELECT COALESCE(SUM(d.demand_qty), 0) AS v
-  FROM demand_daily d
-  JOIN base_sku b ON d.sku = b.sku
-  WHERE d.date > '{base_date}'::DATE - INTERVAL 7 DAY AND d.date <= '{base_date}'
-),
-sku_doh AS (
-  SELECT
-    b.sku,
-    b.category,
-    COALESCE(li.onhand_qty, 0) AS onhand_qty,
-    COALESCE(d.demand_14, 0) AS demand_14,
-    CASE WHEN COALESCE(d.demand_14, 0) > 0
-      THEN ROUND(COALESCE(li.onhand_qty, 0) * {DOS_BASIS_DAYS} * 1.0 / NULLIF(d.demand_14, 0), 1)
-      ELSE NULL END AS coverage_days
-  FROM base_sku b
-  LEFT JOIN latest_inv li ON b.sku = li.sku
-  LEFT JOIN demand_14 d ON b.sku = d.sku
-)
-SELECT
-  (SELECT COALESCE(SUM(onhand_qty), 0) FROM sku_doh) AS total_onhand,
-  (SELECT COALESCE(v, 0) FROM demand_7) AS demand_cur_7,
-  (SELECT MEDIAN(coverage_days) FROM sku_doh WHERE coverage_days IS NOT NULL) AS median_dos,
-  (SELECT COUNT(*) FROM sku_doh WHERE coverage_days IS NOT NULL AND coverage_days < {SHORTAGE_DAYS}) AS stockout_sku_cnt
-"""
-kpi_row = con.execute(kpi_sql).fetchdf().iloc[0]
+base_df = fetch_detail(data_key, cat, wh, sku_pick, base_date, DOS_BASIS_DAYS)
+kpi_row = summarize_kpi(base_df, DOS_BASIS_DAYS, SHORTAGE_DAYS)
 total_onhand = int(pd.to_numeric(kpi_row["total_onhand"], errors="coerce")) if pd.notna(kpi_row["total_onhand"]) else 0
 demand_cur_7 = int(pd.to_numeric(kpi_row["demand_cur_7"], errors="coerce")) if pd.notna(kpi_row["demand_cur_7"]) else 0
 median_dos_val = kpi_row["median_dos"]
 stockout_sku_cnt = int(pd.to_numeric(kpi_row["stockout_sku_cnt"], errors="coerce")) if pd.notna(kpi_row["stockout_sku_cnt"]) else 0
 
-detail_sql = f"""
-WITH base_sku AS (
-  SELECT m.sku, m.sku_name, m.category
-  FROM sku_master m WHERE 1=1 {base_where}
-),
-latest_inv AS (
-  SELECT sku, warehouse, onhand_qty
-  FROM inventory_daily
-  WHERE date = '{base_date}' {_inv_wh_where(wh)}
-),
-demand_30 AS (
-  SELECT sku, SUM(demand_qty) AS demand_30d
-  FROM demand_daily
-  WHERE date > '{base_date}'::DATE - INTERVAL 30 DAY AND date <= '{base_date}'
-  GROUP BY sku
-),
-demand_14 AS (
-  SELECT sku, SUM(demand_qty) AS demand_14
-  FROM demand_daily
-  WHERE date > '{base_date}'::DATE - INTERVAL {DOS_BASIS_DAYS} DAY AND date <= '{base_date}'
-  GROUP BY sku
-),
-demand_7d AS (
-  SELECT sku, SUM(demand_qty) AS demand_7d
-  FROM demand_daily
-  WHERE date > '{base_date}'::DATE - INTERVAL 7 DAY AND date <= '{base_date}'
-  GROUP BY sku
-)
-SELECT
-  b.sku, b.sku_name, b.category, li.warehouse,
-  COALESCE(li.onhand_qty, 0) AS onhand_qty,
-  COALESCE(d30.demand_30d, 0) AS demand_30d,
-  COALESCE(d14.demand_14, 0) AS demand_14,
-  COALESCE(d7.demand_7d, 0) AS demand_7d,
-  CASE WHEN COALESCE(d14.demand_14, 0) > 0
-    THEN ROUND(COALESCE(li.onhand_qty, 0) * {DOS_BASIS_DAYS} * 1.0 / NULLIF(d14.demand_14, 0), 1)
-    ELSE NULL END AS coverage_days,
-  CASE WHEN COALESCE(d14.demand_14, 0) > 0
-    THEN date_add('{base_date}'::DATE, CAST(CEIL(COALESCE(li.onhand_qty, 0) * {DOS_BASIS_DAYS} * 1.0 / NULLIF(d14.demand_14, 0)) AS INTEGER))
-    ELSE NULL END AS estimated_stockout_date
-FROM base_sku b
-LEFT JOIN latest_inv li ON b.sku = li.sku
-LEFT JOIN demand_30 d30 ON b.sku = d30.sku
-LEFT JOIN demand_14 d14 ON b.sku = d14.sku
-LEFT JOIN demand_7d d7 ON b.sku = d7.sku
-"""
-base_df = con.execute(detail_sql).fetchdf()
-
 # --- (A) base_df 생성 직후: 예측 merge 및 doh_used / est_date_used / demand7_used 생성 ---
 if base_df.empty:
     # 빈 경우에도 아래 컬럼들이 존재하도록 미리 생성
@@ -437,19 +671,13 @@ if base_df.empty:
 else:
     if use_forecast and not forecast_metrics_df.empty:
         fm = forecast_metrics_df[["sku", "forecast_dos", "stockout_date_forecast", "forecast_demand_next7", "forecast_avg_daily"]].drop_duplicates("sku")
+        # 예측 쪽 sku를 상세 결과의 category dtype에 맞춰 병합 (키가 문자열로 풀리지 않도록, 상세에 없는 SKU는 어차피 매칭되지 않으므로 먼저 제외)
+        fm = fm[fm["sku"].isin(base_df["sku"].cat.categories)].astype({"sku": base_df["sku"].dtype})
         base_df = base_df.merge(fm, on="sku", how="left")
-        base_df["doh_used"] = base_df.apply(
-            lambda r: r["forecast_dos"] if pd.notna(r.get("forecast_dos")) else r["coverage_days"],
-            axis=1,
-        )
-        base_df["est_date_used"] = base_df.apply(
-            lambda r: r["stockout_date_forecast"] if pd.notna(r.get("stockout_date_forecast")) else r["estimated_stockout_date"],
-            axis=1,
-        )
-        base_df["demand7_used"] = base_df.apply(
-            lambda r: r["forecast_demand_next7"] if pd.notna(r.get("forecast_demand_next7")) else r["demand_7d"],
-            axis=1,
-        )
+        # 예측값이 있으면 예측값, 없으면 실적 기반 값 (컬럼 단위 combine_first)
+        base_df["doh_used"] = base_df["forecast_dos"].combine_first(base_df["coverage_days"])
+        base_df["est_date_used"] = base_df["stockout_date_forecast"].combine_first(base_df["estimated_stockout_date"])
+        base_df["demand7_used"] = base_df["forecast_demand_next7"].combine_first(base_df["demand_7d"])
         base_df["avg_daily_demand"] = base_df["forecast_avg_daily"].fillna(0)
     else:
         base_df["doh_used"] = base_df["coverage_days"]
@@ -459,43 +687,122 @@ else:
 
 
 # --- (C) 상태 컬럼(상태/_mark) 한 번만 생성 ---
+STATUS_MARKS = {"긴급": "🔴", "주의": "🟠", "안정": "🟢"}
+
+
 def classify_status(est_date, doh):
-    # 1) DOH가 있으면 DOH를 최우선으로 상태 결정 (운영 관점에서 가장 안정적)
-    if pd.notna(doh):
-        if doh < LEAD_TIME_DAYS:
-            return "🔴", "긴급"
-        if doh < SHORTAGE_DAYS:
-            return "🟠", "주의"
-        return "🟢", "안정"
-
-    # 2) DOH가 없으면(수요 0 등) 날짜로 보조 판단
+    """est_date/doh 컬럼 전체를 받아 상태 라벨(긴급/주의/안정) Series를 반환 (행 단위 루프 없이 np.select)."""
     est = pd.to_datetime(est_date, errors="coerce")
-    if pd.isna(est):
-        # 수요가 없어 DOH/예상 소진일 산출 불가 → 품절 관점은 안정,
-        # 대신 Action에서 '수요 없음 + 재고 보유'로 잡아야 함
-        return "🟢", "안정"
+    has_doh = doh.notna()
+    # 1) DOH가 있으면 DOH를 최우선으로 상태 결정 (운영 관점에서 가장 안정적)
+    # 2) DOH가 없으면(수요 0 등) 날짜로 보조 판단. 날짜도 없으면(NaT 비교는 False) 품절 관점은 안정,
+    #    대신 Action에서 '수요 없음 + 재고 보유'로 잡아야 함
+    urgent = (has_doh & (doh < LEAD_TIME_DAYS)) | (~has_doh & (est < LEAD_CUT_TS))
+    warn = (has_doh & (doh < SHORTAGE_DAYS)) | (~has_doh & (est < SHORTAGE_CUT_TS))
+    return pd.Series(np.select([urgent, warn], ["긴급", "주의"], default="안정"), index=doh.index)
+
+
+status_labels = classify_status(base_df["est_date_used"], base_df["doh_used"])
+# 값 종류가 3개뿐인 상태·마크 컬럼은 category(int8 코드)로 보관 — 비교·정렬·직렬화 비용 절감
+base_df["_mark"] = status_labels.map(STATUS_MARKS).astype(pd.CategoricalDtype(list(STATUS_MARKS.values())))
+base_df["상태"] = status_labels.astype(pd.CategoricalDtype(list(STATUS_MARKS)))
+
+# 우선순위 지수 = 7일 수요 ÷ max(DOH, 1) (값이 없으면 NaN 유지)
+base_df["priority_score"] = base_df["demand7_used"] / np.maximum(base_df["doh_used"], 1)
+
+# --- 상태 요약: 분포·최악 상태를 한 번만 계산해 모든 탭에서 재사용 ---
+status_counts = base_df["상태"].value_counts().rename_axis("상태").reset_index(name="count")
+status_counts = status_counts[status_counts["count"] > 0]  # category라 0건 상태도 집계되므로 제외
+present_states = set(status_counts["상태"])
+if "긴급" in present_states:
+    worst_state, worst_mark = "긴급", "🔴"
+elif "주의" in present_states:
+    worst_state, worst_mark = "주의", "🟠"
+else:
+    worst_state, worst_mark = "안정", "🟢"
 
-    if est < base_date_ts + pd.Timedelta(days=LEAD_TIME_DAYS):
-        return "🔴", "긴급"
-    if est < base_date_ts + pd.Timedelta(days=SHORTAGE_DAYS):
-        return "🟠", "주의"
-    return "🟢", "안정"
+# --- 최근 30일 수요 분위수: 전체 SKU 기준과 DOH 보유 SKU 기준을 한 번씩만 계산 (탭마다 재정렬하지 않음) ---
+demand_q25_all, demand_q75_all = base_df["demand_30d"].quantile([0.25, 0.75]).to_numpy(dtype=float)
+demand_q25_doh, demand_q75_doh = base_df.loc[base_df["doh_used"].notna(), "demand_30d"].quantile([0.25, 0.75]).to_numpy(dtype=float)
+
+
+# --- Action 테이블: 입력(상세 결과·정책값)이 같으면 rerun 시 캐시에서 바로 반환 ---
+ACTION_INPUT_COLS = ["sku", "sku_name", "warehouse", "_mark", "onhand_qty", "demand_30d", "doh_used", "avg_daily_demand", "priority_score"]
+
+
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: _df_fingerprint})
+def build_action_df(base_df, demand_p25, shortage_days, over_days, lead_time_days):
+    """발주·재고 조정 대상 SKU 테이블 생성 (분류·수량·사유·우선순위까지)."""
+    action_df = pd.DataFrame()
+    # 행 단위 iterrows 대신 컬럼 전체에 대한 불리언 마스크로 분류·수량·사유를 한 번에 계산
+    cov = base_df["doh_used"]
+    # onhand_qty(int32)·demand_30d는 DETAIL_SQL의 COALESCE로, avg_daily_demand는 (A)의 fillna로 결측이 없음 → 재변환 없이 사용
+    onhand = base_df["onhand_qty"]
+    d30 = base_df["demand_30d"]
+    avg_d = base_df["avg_daily_demand"]
+    has_avg = avg_d > 0
+
+    is_order = cov.notna() & (cov < shortage_days) & (d30 > 0)
+    is_reduce = ~is_order & cov.notna() & (cov > over_days) & (d30 <= demand_p25)
+    is_review = ~is_order & ~is_reduce & (d30 == 0) & (onhand > 0)
+
+    # 조치 대상 행만 남긴 뒤 수량·사유 문자열 계산 (유지 대상 SKU는 문자열을 만들지 않음)
+    # doh_used는 예측 DOS를 섞은 값이라 SQL 단계가 아닌 여기서 거름 (demand_p25는 호출부에서 전체 SKU 기준으로 전달)
+    keep = is_order | is_reduce | is_review
+    if keep.any():
+        src = base_df[keep]
+        cov, onhand, avg_d, has_avg = cov[keep], onhand[keep], avg_d[keep], has_avg[keep]
+        is_order, is_reduce, is_review = is_order[keep], is_reduce[keep], is_review[keep]
+        conds = [is_order, is_reduce, is_review]
+
+        leadtime_demand = (avg_d * lead_time_days).where(is_order & has_avg, 0.0)
+        rec_qty = np.ceil(leadtime_demand - onhand).clip(lower=0).where(is_order & has_avg, 0).astype(int)
+        target_stock = np.ceil(over_days * avg_d).where(is_reduce & has_avg, 0).astype(int)
+        reduce_qty = (onhand - target_stock).clip(lower=0).where(is_reduce & has_avg, 0).astype(int)
+
+        cov_txt = fmt_days_col(cov)
+        no_demand_txt = " (수요 정보 부족)"
+        order_reason = (
+            f"재고회전일수(DOH)가 정책 기준({shortage_days}일)보다 짧음(현재 " + cov_txt + "일)."
+            + (f" 리드타임({lead_time_days}일) 예상 수요 대비 현재고 부족 → 추천 발주 " + rec_qty.astype(str) + "개").where(has_avg, no_demand_txt)
+        )
+        reduce_reason = (
+            f"재고회전일수(DOH)가 {over_days}일을 초과하고 최근 수요가 낮음"
+            + (" 현재 DOH(" + cov_txt + f"일) → 목표 DOH({over_days}일) 조정 시 감축 수량 " + reduce_qty.astype(str) + "개").where(has_avg, no_demand_txt)
+        )
 
-if base_df.empty:
-    base_df["_mark"] = pd.Series(dtype="object")
-    base_df["상태"] = pd.Series(dtype="object")
-else:
-    marks, labels = zip(*[
-        classify_status(r.get("est_date_used"), r.get("doh_used"))
-        for _, r in base_df.iterrows()
-    ])
-    base_df["_mark"] = list(marks)
-    base_df["상태"] = list(labels)
-
-base_df["priority_score"] = base_df.apply(
-    lambda r: (r.get("demand7_used") or 0) / max((r.get("doh_used") or 1), 1),
-    axis=1,
-)
+        action_df = pd.DataFrame({
+            "상태": src["_mark"],
+            "SKU": src["sku"],
+            "품목명": src["sku_name"],
+            "창고": src["warehouse"],
+            "재고 리스크": np.select(conds, ["발주 지연 시 품절 발생 가능", "재고 유지 비용·폐기 리스크 증가", "재고 부패·폐기 가능성 존재"], default=""),
+            "재고 리스크 권장 조치 사항": np.select(conds, ["발주", "재고 감축", "재고 조정 검토"], default=""),
+            "발주 우선순위 지수": src["priority_score"],
+            "리드타임 수요(개)": np.round(leadtime_demand).astype(int),
+            "추천 발주 수량(개)": rec_qty,
+            "안전재고(개)": 0,
+            "목표 재고(개)": target_stock,
+            "감축 추천 수량(개)": reduce_qty,
+            "비고": np.select(conds, [order_reason, reduce_reason, "최근 30일 수요가 없는 SKU로 재고만 보유"], default=""),
+        })
+
+    if not action_df.empty:
+        action_df.columns = action_df.columns.str.replace(r"\s+", " ", regex=True).str.strip()
+        action_df = action_df.rename(columns={"발주 우선 순위 지수": "발주 우선순위 지수"})
+        # 우선순위: 지수 높은 순 1, 2, 3... (내림차순 → 1이 최우선)
+        # 지수가 없는(DOH 없음) 행은 맨 뒤 순위로 — NaN 순위가 int 변환에서 실패하지 않도록
+        score_col = "발주 우선순위 지수"
+        scores = action_df[score_col].to_numpy(dtype=float)
+        action_df["우선순위"] = action_df[score_col].rank(ascending=False, method="min", na_option="bottom").astype(int)
+        action_df = action_df.drop(columns=[score_col])
+        # 순위 열을 다시 정렬하지 않고 점수 배열의 안정 argsort로 바로 재배열 (동점은 원래 순서 유지, NaN은 뒤로)
+        action_df = action_df.iloc[np.argsort(-scores, kind="stable")]
+        # 컬럼 순서: 우선순위를 상태 다음으로
+        cols = [c for c in action_df.columns if c != "우선순위"]
+        idx = cols.index("상태") + 1 if "상태" in cols else 0
+        action_df = action_df[cols[:idx] + ["우선순위"] + cols[idx:]]
+    return action_df
 
 
 # --- 상단 헤더: 왼쪽 타이틀 + 오른쪽 상단 정책/예측 박스 2개 ---
@@ -530,14 +837,6 @@ tab_overview, tab_cause, tab_time, tab_action, tab_admin = st.tabs([
 # ========== 1) Overview (요약) — 1) 지금 재고 상태는 안전한가? ==========
 with tab_overview:
     # 탭 상단 상태 배지 + 핵심 한 문장
-    worst_state = "안정"
-    worst_state, worst_mark = "안정", "🟢"
-    if not base_df.empty:
-        if (base_df["상태"] == "긴급").any():
-            worst_state, worst_mark = "긴급", "🔴"
-        elif (base_df["상태"] == "주의").any():
-            worst_state, worst_mark = "주의", "🟠"
-
     risk_cnt = int((base_df["doh_used"].notna() & (base_df["doh_used"] < SHORTAGE_DAYS)).sum()) if not base_df.empty else 0
     st.markdown(f"{worst_mark} 현재 재고 상태는 {worst_state}으로, 품절 위험 SKU {risk_cnt}건 입니다.")
 
@@ -559,31 +858,16 @@ with tab_overview:
     with col_pie:
         st.markdown("**재고 상태 분포**")
         if not base_df.empty:
-            status_counts = base_df["상태"].value_counts().rename_axis("상태").reset_index(name="count")
-            color_map = {"긴급": "#ef5350", "주의": "#ff9800", "안정": "#4caf50"}
-            fig_pie = px.pie(status_counts, names="상태", values="count", color="상태", color_discrete_map=color_map, hole=0.4)
-            fig_pie.update_layout(showlegend=True, margin=dict(t=30, b=30, l=30, r=30))
-            fig_pie.update_traces(
-                textfont_size=22,
-                insidetextfont=dict(size=22),
-                marker=dict(line=dict(color="rgba(255,255,255,0.95)", width=1.5)),
-                pull=[0.01, 0.02, 0],
-            )
-            fig_pie = apply_plotly_theme(fig_pie)
-            st.plotly_chart(fig_pie, use_container_width=True)
+            st.plotly_chart(go.Figure(build_status_pie(status_counts)), use_container_width=True, key="overview_status_pie")
         else:
             st.caption("표시할 상태 데이터가 없습니다.")
     with col_bar:
         if cat == "ALL" and not base_df.empty:
             st.markdown("**카테고리별 품절 위험 SKU 수**")
-            risk_df = base_df[base_df["상태"].isin(["긴급", "주의"])].copy()
+            risk_df = base_df[base_df["상태"].isin(["긴급", "주의"])]
             if not risk_df.empty:
-                bar_df = risk_df.groupby("category")["sku"].nunique().reset_index(name="risk_sku_cnt")
-                fig_bar = px.bar(bar_df, x="category", y="risk_sku_cnt", color="category", labels={"category": "카테고리", "risk_sku_cnt": "품절 위험 SKU 수"}, color_discrete_sequence=["#6366f1", "#818cf8", "#a5b4fc", "#c7d2fe"])
-                fig_bar.update_layout(margin=dict(t=30, b=30, l=30, r=30), showlegend=False)
-                fig_bar.update_traces(marker_line_color="rgba(255,255,255,0.9)", marker_line_width=1)
-                fig_bar = apply_plotly_theme(fig_bar)
-                st.plotly_chart(fig_bar, use_container_width=True)
+                bar_df = risk_df.groupby("category", observed=True)["sku"].nunique().reset_index(name="risk_sku_cnt")
+                st.plotly_chart(go.Figure(build_category_bar(bar_df)), use_container_width=True, key="overview_category_bar")
             else:
                 st.caption("품절 위험 SKU가 없습니다.")
         else:
@@ -596,7 +880,7 @@ with tab_overview:
     if not base_df.empty:
         urgent_mask = base_df["상태"] == "긴급"
         warn_mask = base_df["상태"] == "주의"
-        high_demand = base_df["demand_30d"] >= base_df["demand_30d"].quantile(0.75)
+        high_demand = base_df["demand_30d"] >= demand_q75_all
         low_doh = base_df["doh_used"].notna() & (base_df["doh_used"] < SHORTAGE_DAYS)
         high_demand_low_doh = (high_demand & low_doh)
         n_urgent = int(urgent_mask.sum())
@@ -610,27 +894,19 @@ with tab_overview:
 
 # ========== 2) 재고 위험 원인 분석 (Cause) — 2) 어떤 SKU가 문제인가, 왜? ==========
 with tab_cause:
-    worst_state = "안정"
-    worst_mark = "🟢"
-    if not base_df.empty:
-        if (base_df["상태"] == "긴급").any():
-            worst_state, worst_mark = "긴급", "🔴"
-        elif (base_df["상태"] == "주의").any():
-            worst_state, worst_mark = "주의", "🟠"
     st.markdown(f"{worst_mark} 문제 SKU 및 원인을 확인하세요.")
     st.caption(
         "※ 수요 수준은 최근 30일 수요의 상·하위 25% 분위수 기준으로 상대 분류. \n"
         "재고회전일수(DOH)는 관리자 설정 정책 기준(품절 위험·재고 과잉 일수)을 적용"
     )
 
-    health = base_df.copy()
-    health_with_doh = health[health["doh_used"].notna()].copy()
+    # 읽기 전용 부분집합이라 복사하지 않음 (표시용 disp만 별도 복사 후 가공)
+    health_with_doh = base_df[base_df["doh_used"].notna()]
 
     col_cards, col_chart = st.columns([1, 2])
     with col_cards:
         if not health_with_doh.empty:
-            demand_p75 = float(health_with_doh["demand_30d"].quantile(0.75))
-            demand_p25 = float(health_with_doh["demand_30d"].quantile(0.25))
+            demand_p75, demand_p25 = demand_q75_doh, demand_q25_doh
             cond_high_short = (health_with_doh["demand_30d"] >= demand_p75) & (health_with_doh["doh_used"] < SHORTAGE_DAYS)
             cond_low_long = (health_with_doh["demand_30d"] <= demand_p25) & (health_with_doh["doh_used"] > OVER_DAYS)
             cond_zero_with_stock = (health_with_doh["demand_30d"] == 0) & (health_with_doh["onhand_qty"] > 0)
@@ -641,86 +917,23 @@ with tab_cause:
             st.caption("원인 분석을 위한 데이터가 부족합니다.")
     with col_chart:
         if not health_with_doh.empty:
-            demand_p75 = float(health_with_doh["demand_30d"].quantile(0.75))
-            fig = px.scatter(
-                health_with_doh,
-                x="demand_30d",
-                y="doh_used",
-                size="demand_30d",
-                color="상태",
-                color_discrete_map={"긴급": "#e11d48", "주의": "#f97316", "안정": "#22c55e"},
-                hover_data=["sku", "sku_name", "onhand_qty", "demand_30d", "doh_used"],
-                title="수요 × 재고회전일수(DOH) 매트릭스",
+            fig_dict = build_cause_scatter(
+                health_with_doh[["sku", "sku_name", "onhand_qty", "demand_30d", "doh_used", "상태"]],
+                demand_p75,
+                demand_p25,
+                SHORTAGE_DAYS,
+                OVER_DAYS,
             )
-            fig.update_layout(xaxis_title="최근 30일 수요(개)", yaxis_title="재고회전일수(DOH)")
-            add_ref_hline(fig, SHORTAGE_DAYS, f"품절 위험 기준({SHORTAGE_DAYS}일)", line_color="crimson")
-            add_ref_hline(fig, OVER_DAYS, f"재고 과다 검토 기준({OVER_DAYS}일)", line_color="steelblue")
-            add_ref_vline(fig, demand_p75, "수요 상위 25%", line_color="gray")
-            # 왼쪽 카드 3개(수요·DOH 조건)의 위치를 매트릭스에서 직관적으로 보여주기 위해
-            # 해당 조건에 속하는 점들에 동그라미 테두리 오버레이를 추가
-            cond_high_short_chart = (health_with_doh["demand_30d"] >= demand_p75) & (health_with_doh["doh_used"] < SHORTAGE_DAYS)
-            cond_low_long_chart = (health_with_doh["demand_30d"] <= demand_p25) & (health_with_doh["doh_used"] > OVER_DAYS)
-            cond_zero_with_stock_chart = (health_with_doh["demand_30d"] == 0) & (health_with_doh["onhand_qty"] > 0)
-
-            hs_pts = health_with_doh[cond_high_short_chart]
-            if not hs_pts.empty:
-                fig.add_scatter(
-                    x=hs_pts["demand_30d"],
-                    y=hs_pts["doh_used"],
-                    mode="markers",
-                    marker=dict(
-                        size=22,
-                        symbol="circle-open",
-                        line=dict(color="#b91c1c", width=2),
-                    ),
-                    showlegend=False,
-                    hoverinfo="skip",
-                )
-
-            ll_pts = health_with_doh[cond_low_long_chart]
-            if not ll_pts.empty:
-                fig.add_scatter(
-                    x=ll_pts["demand_30d"],
-                    y=ll_pts["doh_used"],
-                    mode="markers",
-                    marker=dict(
-                        size=22,
-                        symbol="circle-open",
-                        line=dict(color="#1d4ed8", width=2),
-                    ),
-                    showlegend=False,
-                    hoverinfo="skip",
-                )
-
-            zs_pts = health_with_doh[cond_zero_with_stock_chart]
-            if not zs_pts.empty:
-                fig.add_scatter(
-                    x=zs_pts["demand_30d"],
-                    y=zs_pts["doh_used"],
-                    mode="markers",
-                    marker=dict(
-                        size=22,
-                        symbol="circle-open",
-                        line=dict(color="#374151", width=2),
-                    ),
-                    showlegend=False,
-                    hoverinfo="skip",
-                )
-            fig = apply_plotly_theme(fig)
-            st.plotly_chart(fig, use_container_width=True)
+            st.plotly_chart(go.Figure(fig_dict), use_container_width=True, key="cause_scatter")
         else:
             st.caption("표시할 데이터가 없습니다.")
 
     st.markdown("**[SKU 분석] 재고회전일수 (DOH) 가 정책 기준보다 짧고, 수요 영향도가 높아 우선 점검 필요한 항목**")
-    short_high = health_with_doh[(health_with_doh["doh_used"] < SHORTAGE_DAYS) & (health_with_doh["demand_30d"] > 0)].copy()
+    short_high = health_with_doh[(health_with_doh["doh_used"] < SHORTAGE_DAYS) & (health_with_doh["demand_30d"] > 0)]
     if not short_high.empty:
         demand_p75_val = short_high["demand_30d"].quantile(0.75)
         short_high = short_high[short_high["demand_30d"] >= demand_p75_val].sort_values("doh_used", ascending=True)
-        disp = short_high[["sku", "sku_name", "warehouse", "onhand_qty", "demand_30d", "doh_used", "_mark", "상태"]].copy()
-        disp["onhand_qty"] = disp["onhand_qty"].apply(fmt_qty)
-        disp["demand_30d"] = disp["demand_30d"].apply(fmt_qty)
-        disp["doh_used"] = disp["doh_used"].apply(lambda x: fmt_days(x) + "일" if pd.notna(x) else "—")
-        disp = disp.rename(columns={
+        disp = short_high[["sku", "sku_name", "warehouse", "onhand_qty", "demand_30d", "doh_used", "_mark", "상태"]].rename(columns={
             "sku": "SKU",
             "sku_name": "품목명",
             "warehouse": "창고",
@@ -729,156 +942,59 @@ with tab_cause:
             "doh_used": "재고회전일수(DOH)",
             "_mark": "상태 마크",
         })
-        st.dataframe(disp, use_container_width=True, hide_index=True)
+        # 숫자 컬럼은 그대로 두고 표시 형식만 Styler로 지정 (문자열 컬럼 재생성 없음, 표에서 숫자 정렬 유지)
+        disp_style = disp.style.format({"현재고(개)": "{:,.0f}", "최근 30일 수요(개)": "{:,.0f}", "재고회전일수(DOH)": "{:.1f}일"}, na_rep="—")
+        st.dataframe(disp_style, use_container_width=True, hide_index=True)
     else:
         st.caption("해당 조건을 만족하는 SKU가 없습니다.")
 
 # ========== 3) 품절 발생 시점 분석 (Time) — 3) 언제 문제가 발생하는가? ==========
 with tab_time:
-    worst_state = "안정"
-    worst_mark = "🟢"
-    if not base_df.empty:
-        if (base_df["상태"] == "긴급").any():
-            worst_state, worst_mark = "긴급", "🔴"
-        elif (base_df["상태"] == "주의").any():
-            worst_state, worst_mark = "주의", "🟠"
     st.markdown(f"{worst_mark} 언제 품절이 발생하는지 타임라인으로 확인하세요.")
 
-    time_df = base_df.copy()
-    time_df["est_date_used"] = pd.to_datetime(time_df["est_date_used"], errors="coerce")
+    # est_date_used는 (A)에서 datetime64로 만들어지므로 형식이 다를 때만 변환 (그 외엔 복사·변환 없음)
+    time_df = base_df
+    if not pd.api.types.is_datetime64_any_dtype(time_df["est_date_used"]):
+        time_df = time_df.assign(est_date_used=pd.to_datetime(time_df["est_date_used"], errors="coerce"))
 
     st.markdown("**[SKU 분석] 예상 소진일 타임라인**" + (" (예측)" if use_forecast else " (실적 기반)"))
     if not time_df.empty and time_df["est_date_used"].notna().any():
-        tl = time_df[time_df["est_date_used"].notna()].copy()
-        tl["date"] = tl["est_date_used"]
-        tl["count"] = 1
-        fig_t = px.scatter(
-            tl,
-            x="date",
-            y="sku",
-            color="상태",
-            color_discrete_map={"긴급": "#e11d48", "주의": "#f97316", "안정": "#22c55e"},
-            hover_data=["sku", "sku_name", "warehouse", "doh_used"]
-        )
-        fig_t.update_layout(
-            xaxis_title="예상 소진일",
-            yaxis_title="SKU",
-            xaxis=dict(tickformat="%Y-%m-%d"),
-        )
-        fig_t = apply_plotly_theme(fig_t)
-        st.plotly_chart(fig_t, use_container_width=True)
+        # 필요한 컬럼만 한 번 슬라이스 (전체 복사·date/count 보조 컬럼 없이 est_date_used를 x로 바로 사용)
+        tl = time_df.loc[time_df["est_date_used"].notna(), ["est_date_used", "sku", "sku_name", "warehouse", "doh_used", "상태"]]
+        st.plotly_chart(go.Figure(build_stockout_timeline(tl)), use_container_width=True, key="time_stockout_timeline")
     else:
         st.caption("예상 소진일 정보가 없습니다.")
 
     st.markdown("**[SKU 분석] 재고회전일수·리드타임 대비 현 재고 상태 확인**" + (" (예측)" if use_forecast else " (실적 기반)"))
-    show_time = time_df[time_df["doh_used"].notna()].copy()
+    show_time = time_df[time_df["doh_used"].notna()]
+    # 상태는 긴급→주의→안정 순서의 categorical이라 정렬 한 번으로 상태·소진일 순서가 정해짐 (보조 순서 컬럼·재정렬 불필요)
     show_time = show_time.sort_values(["상태", "est_date_used"], ascending=[True, True])
     if not show_time.empty:
-        disp_t = show_time[["sku", "sku_name", "warehouse", "est_date_used", "doh_used", "_mark", "상태"]].copy()
-        disp_t["예상 소진일"] = disp_t["est_date_used"].apply(fmt_date)
-        disp_t["재고회전일수(DOH)"] = disp_t["doh_used"].apply(lambda x: fmt_days(x) + "일" if pd.notna(x) else "—")
-        disp_t = disp_t.rename(columns={
+        disp_t = show_time[["sku", "sku_name", "warehouse", "_mark", "상태", "est_date_used", "doh_used"]].rename(columns={
             "sku": "SKU",
             "sku_name": "품목명",
             "warehouse": "창고",
             "_mark": "상태 마크",
             "상태": "품절 대비 재고 상태",
+            "est_date_used": "예상 소진일",
+            "doh_used": "재고회전일수(DOH)",
         })
-        disp_t = disp_t.drop(columns=["est_date_used", "doh_used"])
-        state_order = {"긴급": 0, "주의": 1, "안정": 2}
-        disp_t["_order"] = disp_t["품절 대비 재고 상태"].map(state_order)
-        disp_t = disp_t.sort_values(["_order", "예상 소진일"])
-        disp_t = disp_t.drop(columns=["_order"])
-        st.dataframe(disp_t, use_container_width=True, hide_index=True)
+        # 날짜·일수는 원래 타입 그대로 두고 표시 형식만 Styler로 지정
+        disp_style = disp_t.style.format({"예상 소진일": "{:%Y-%m-%d}", "재고회전일수(DOH)": "{:.1f}일"}, na_rep="—")
+        st.dataframe(disp_style, use_container_width=True, hide_index=True)
     else:
         st.caption("DOH가 산출된 SKU가 없습니다.")
 
 # ========== 4) 권장 발주·재고 조정 (Action) — 4) 무엇을 조치해야 하는가? ==========
 with tab_action:
-    worst_state = "안정"
-    worst_mark = "🟢"
-    if not base_df.empty:
-        if (base_df["상태"] == "긴급").any():
-            worst_state, worst_mark = "긴급", "🔴"
-        elif (base_df["상태"] == "주의").any():
-            worst_state, worst_mark = "주의", "🟠"
     st.markdown(f"{worst_mark} 현 시점 발주·재고 조정이 필요한 SKU를 우선순위로 정렬합니다.")
 
     st.markdown("**[SKU 분석] 즉시 발주 또는 재고 조정 검토 필요**" + (" (예측 기반)" if use_forecast else " (실적 기반)"))
     st.caption("이 테이블은 현 기준 발주·재고 조정이 필요한 SKU별 조치 사유 및 리스크를 보여줍니다. \n"
                 "우선순위 지수는 최근 7일 수요 ÷ max(DOH,1)로 산출합니다. (예측이 있으면 예측 7일 수요 사용)")
 
-    action_list = []
-    if not base_df.empty:
-        demand_p25 = float(base_df["demand_30d"].quantile(0.25)) if not base_df["demand_30d"].empty else 0
-        for _, row in base_df.iterrows():
-            cov = row.get("doh_used")
-            onhand = int(row.get("onhand_qty", 0) or 0)
-            d30 = float(row.get("demand_30d", 0) or 0)
-            state_mark = row.get("_mark", "🟢")
-            state_label = row.get("상태", "안정")
-
-            reason = risk = action = None
-            leadtime_demand_val = rec_qty_val = safety_stock_val = 0
-            target_stock_val = reduce_qty_val = 0
-            if pd.notna(cov) and cov < SHORTAGE_DAYS and d30 > 0:
-                reason = f"재고회전일수(DOH)가 정책 기준({SHORTAGE_DAYS}일)보다 짧음(현재 {fmt_days(cov)}일)."
-                risk = "발주 지연 시 품절 발생 가능"
-                action = "발주"
-                avg_d = float(row.get("avg_daily_demand") or 0)
-                if avg_d > 0 and not pd.isna(avg_d):
-                    leadtime_demand_val = avg_d * LEAD_TIME_DAYS
-                    safety_stock_val = 0
-                    rec_qty_val = max(0, math.ceil(leadtime_demand_val + safety_stock_val - onhand))
-                    reason += f" 리드타임({LEAD_TIME_DAYS}일) 예상 수요 대비 현재고 부족 → 추천 발주 {rec_qty_val}개"
-                else:
-                    reason += " (수요 정보 부족)"
-            elif pd.notna(cov) and cov > OVER_DAYS and d30 <= demand_p25:
-                reason = f"재고회전일수(DOH)가 {OVER_DAYS}일을 초과하고 최근 수요가 낮음"
-                risk = "재고 유지 비용·폐기 리스크 증가"
-                action = "재고 감축"
-                avg_d = float(row.get("avg_daily_demand") or 0)
-                if avg_d > 0 and not pd.isna(avg_d):
-                    target_stock_val = math.ceil(OVER_DAYS * avg_d)
-                    reduce_qty_val = max(0, math.ceil(onhand - target_stock_val))
-                    reason += f" 현재 DOH({fmt_days(cov)}일) → 목표 DOH({OVER_DAYS}일) 조정 시 감축 수량 {reduce_qty_val}개"
-                else:
-                    reason += " (수요 정보 부족)"
-            elif d30 == 0 and onhand > 0:
-                reason = "최근 30일 수요가 없는 SKU로 재고만 보유"
-                risk = "재고 부패·폐기 가능성 존재"
-                action = "재고 조정 검토"
-            else:
-                continue
-            action_list.append({
-                "상태": state_mark,
-                "SKU": row["sku"],
-                "품목명": row.get("sku_name", ""),
-                "창고": row.get("warehouse", "—"),
-                "재고 리스크": risk,
-                "재고 리스크 권장 조치 사항": action,
-                "발주 우선순위 지수": row.get("priority_score", 0.0),
-                "리드타임 수요(개)": int(round(leadtime_demand_val)),
-                "추천 발주 수량(개)": rec_qty_val,
-                "안전재고(개)": safety_stock_val,
-                "목표 재고(개)": target_stock_val,
-                "감축 추천 수량(개)": reduce_qty_val,
-                "비고": reason,
-            })
-
-    action_df = pd.DataFrame(action_list)
+    action_df = build_action_df(base_df[ACTION_INPUT_COLS], demand_q25_all, SHORTAGE_DAYS, OVER_DAYS, LEAD_TIME_DAYS) if not base_df.empty else pd.DataFrame()
     if not action_df.empty:
-        action_df.columns = action_df.columns.str.replace(r"\s+", " ", regex=True).str.strip()
-        action_df = action_df.rename(columns={"발주 우선 순위 지수": "발주 우선순위 지수"})
-        # 우선순위: 지수 높은 순 1, 2, 3... (내림차순 → 1이 최우선)
-        score_col = "발주 우선순위 지수"
-        action_df["우선순위"] = action_df[score_col].rank(ascending=False, method="min").astype(int)
-        action_df = action_df.drop(columns=[score_col])
-        action_df = action_df.sort_values("우선순위", ascending=True)
-        # 컬럼 순서: 우선순위를 상태 다음으로
-        cols = [c for c in action_df.columns if c != "우선순위"]
-        idx = cols.index("상태") + 1 if "상태" in cols else 0
-        action_df = action_df[cols[:idx] + ["우선순위"] + cols[idx:]]
         st.dataframe(action_df, use_container_width=True, hide_index=True)
     else:
         st.caption("즉시 발주 또는 재고 조정이 필요한 SKU가 없습니다.")
@@ -902,13 +1018,12 @@ with tab_admin:
     st.divider()
     st.subheader("예측 모델 설정")
     st.caption("수요 예측에 사용할 모델·학습일·예측일을 설정합니다. 변경 후 다른 탭에서 즉시 반영됩니다.")
-    model_opts = ["MovingAvg(7)", "MovingAvg(14)", "MovingAvg(30)", "SeasonalNaive(7)"]
-    idx = model_opts.index(st.session_state.get("admin_forecast_model", "MovingAvg(14)")) if st.session_state.get("admin_forecast_model", "MovingAvg(14)") in model_opts else 1
+    idx = MODEL_IDX.get(MODEL_NAME, 1)
     f1, f2, f3, f4 = st.columns(4)
     with f1:
         st.selectbox(
             "예측 모델",
-            options=model_opts,
+            options=MODEL_OPTS,
             index=idx,
             key="admin_forecast_model",
             help="MovingAvg(N): 최근 N일 수요 평균. SeasonalNaive(7): 최근 7일 패턴 반복.",
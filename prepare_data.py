@@ -0,0 +1,38 @@
+"""
+Convert the input CSVs to Parquet (ZSTD) for faster dashboard loads.
+app.py imports parquet_path/TABLES from here and converts a missing or stale <name>.parquet
+on first load; running this ahead of time (e.g. in the devcontainer) keeps that work off
+the first page view. Both use the same rule: convert only when the Parquet file is missing
+or older than its CSV.
+Run: python3 prepare_data.py
+"""
+import os
+import duckdb
+
+# 대시보드가 조회하는 입력 테이블 (CSV 이름 = DuckDB 뷰 이름)
+TABLES = ["sku_master", "demand_daily", "inventory_daily"]
+
+
+def parquet_path(name):
+    """CSV를 Parquet(컬럼형·타입 보존)로 변환해 경로 반환 — 없거나 CSV보다 오래됐을 때만 변환, 쓰기 불가면 None."""
+    csv_path, pq_path = f"{name}.csv", f"{name}.parquet"
+    if os.path.exists(csv_path) and (not os.path.exists(pq_path) or os.path.getmtime(pq_path) < os.path.getmtime(csv_path)):
+        try:
+            duckdb.sql(f"COPY (SELECT * FROM read_csv_auto('{csv_path}')) TO '{pq_path}' (FORMAT PARQUET, COMPRESSION ZSTD)")
+        except duckdb.IOException:
+            return None
+    return pq_path
+
+
+if __name__ == "__main__":
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    for name in TABLES:
+        csv_path = f"{name}.csv"
+        if not os.path.exists(csv_path):
+            print(f"Skip {csv_path}: not found")
+            continue
+        path = parquet_path(name)
+        if path is None:
+            print(f"Skip {name}.parquet: could not write")
+            continue
+        print(f"Ready {path} ({os.path.getsize(csv_path):,} → {os.path.getsize(path):,} bytes)")